@@ -0,0 +1,31 @@
+import threading
+import Queue
+
+
+class BatchPrefetcher:
+    def __init__(self, get_batch_func, number_of_batches, prefetch_size=2):
+        self.get_batch_func = get_batch_func
+        self.number_of_batches = number_of_batches
+        self.prefetch_size = prefetch_size
+
+    def __iter__(self):
+        # the batches are produced in a background thread, so the next batches are prepared while the current one is
+        # being consumed. the source of the batches must not be modified until the iteration is over.
+        batches_queue = Queue.Queue(maxsize=self.prefetch_size)
+
+        def produce():
+            try:
+                for _ in range(self.number_of_batches):
+                    batches_queue.put((self.get_batch_func(), None))
+            except Exception as e:
+                batches_queue.put((None, e))
+
+        producer = threading.Thread(target=produce)
+        producer.daemon = True
+        producer.start()
+        for _ in range(self.number_of_batches):
+            batch, error = batches_queue.get()
+            if error is not None:
+                raise error
+            yield batch
+        producer.join()
@@ -1,4 +1,5 @@
 import os
+import itertools
 import random
 import datetime
 import bz2
@@ -6,6 +7,7 @@ import tensorflow as tf
 import yaml
 import time
 
+from batch_prefetcher import BatchPrefetcher
 from episode_editor import EpisodeEditor
 from hindsight_policy import HindsightPolicy
 from image_cache import ImageCache
@@ -17,6 +19,9 @@ from trajectory_eval import TrajectoryEval
 from pre_trained_reward import PreTrainedReward
 from workspace_generation_utils import *
 
+# one hot status labels of the reward model, indexed by status (0: free, 1: collision, 2: goal)
+_STATUS_ONE_HOT = np.eye(3, dtype=np.float32)
+
 
 def _is_vision(scenario):
     return "vision" in scenario
@@ -50,7 +55,11 @@ def run_for_config(config, print_messages):
     # load images if required
     image_cache = None
     if _is_vision(scenario):
-        image_cache = ImageCache(config["general"]["params_file"], create_images=True)
+        image_cache = ImageCache(
+            config["general"]["params_file"],
+            create_images=True,
+            images_dtype=np.float32,
+        )
 
     # load pretrained model if required
     pre_trained_reward = None
@@ -64,49 +73,32 @@ def run_for_config(config, print_messages):
     )
 
     def unpack_state_batch(state_batch):
-        joints = [state[0] for state in state_batch]
-        poses = {
-            p.tuple: [state[1][p.tuple] for state in state_batch]
-            for p in network.potential_points
-        }
-        jacobians = None
+        # the replay buffer keeps the states as arrays: joints (N, J) and poses (N, P, D) ordered by the potential
+        # points, so no per state unpacking is required
+        joints, poses, jacobians = state_batch
         return joints, poses, jacobians
 
     def score_for_hindsight(augmented_buffer):
         assert _is_vision(scenario)
-        # unzip
-        (
-            goal_pose_list,
-            goal_joints_list,
-            workspace_image_list,
-            current_state_list,
-            action_used_list,
-            _,
-            is_goal_list,
-            __,
-        ) = zip(*augmented_buffer)
+        # the augmented buffer holds a list per field (see HindsightPolicy)
         # make one hot status vector:
-        is_goal_one_hot_list = np.zeros((len(is_goal_list), 3), dtype=np.float32)
-        for i in range(len(is_goal_list)):
-            if is_goal_list[i]:
-                is_goal_one_hot_list[i, 2] = 1.0  # mark as goal transition
-            else:
-                is_goal_one_hot_list[i, 0] = 1.0  # mark as free transition
-        # unpack current and next state
-        current_joints, _, __ = unpack_state_batch(current_state_list)
+        is_goal = np.asarray(augmented_buffer.is_terminal, dtype=np.bool_)
+        is_goal_one_hot_list = _STATUS_ONE_HOT[np.where(is_goal, 2, 0)]
+        # unpack current state
+        current_joints = [state[0] for state in augmented_buffer.current_state]
 
         fake_rewards, _ = pre_trained_reward.make_prediction(
             sess,
             current_joints,
-            goal_joints_list,
-            action_used_list,
-            goal_pose_list,
+            augmented_buffer.goal_joints,
+            augmented_buffer.action_used,
+            augmented_buffer.goal_pose,
             all_transition_labels=is_goal_one_hot_list,
         )
         return list(fake_rewards)
 
     # initialize replay memory
-    replay_buffer = ReplayBuffer(config)
+    replay_buffer = ReplayBuffer(config, image_cache=image_cache)
     hindsight_policy = HindsightPolicy(config, replay_buffer, score_for_hindsight)
 
     # save model
@@ -121,15 +113,25 @@ def run_for_config(config, print_messages):
 
     test_results = []
 
-    def update_model(sess, global_step):
-        batch_size = config["model"]["batch_size"]
-        gamma = config["model"]["gamma"]
+    # values used on every training step are read from the config once
+    batch_size = config["model"]["batch_size"]
+    label_limit = 1.0 / (1.0 - config["model"]["gamma"])
+
+    def sample_training_batch():
         replay_buffer_batch = replay_buffer.sample_batch(batch_size)
 
+        # get image from image cache
+        workspace_image = None
+        if image_cache is not None:
+            workspace_index = replay_buffer_batch[2]
+            workspace_image = image_cache.get_image_batch(workspace_index)
+        return replay_buffer_batch, workspace_image
+
+    def update_model(sess, replay_buffer_batch, workspace_image):
         (
             goal_pose,
             goal_joints,
-            workspace_id,
+            _,
             current_state,
             action,
             reward,
@@ -137,62 +139,42 @@ def run_for_config(config, print_messages):
             next_state,
         ) = replay_buffer_batch
 
-        # get image from image cache
-        workspace_image = None
-        if image_cache is not None:
-            workspace_image = [image_cache.get_image(k) for k in workspace_id]
-
         current_joints, _, __ = unpack_state_batch(current_state)
         next_joints, _, __ = unpack_state_batch(next_state)
 
-        # get the predicted q value of the next state (action is taken from the target policy)
-        next_state_action_target_q = network.predict_policy_q(
-            next_joints,
-            workspace_image,
-            goal_pose,
-            goal_joints,
-            sess,
-            use_online_network=False,
-        )
-
-        # compute critic label
-        q_label = np.expand_dims(
-            np.squeeze(np.array(reward))
-            + np.multiply(
-                np.multiply(1 - np.array(terminated), gamma),
-                np.squeeze(next_state_action_target_q),
-            ),
-            1,
-        )
-        max_label = np.max(q_label)
-        min_label = np.min(q_label)
-        limit = 1.0 / (1.0 - gamma)
-        if max_label > limit:
-            print("out of range max label: {} limit: {}".format(max_label, limit))
-        if min_label < -limit:
-            print("out of range min label: {} limit: {}".format(min_label, limit))
-
-        # # step to use for debug:
+        # # step to use for debug (needs the critic label as input):
         # network.debug_all(current_joints, workspace_image, goal_pose, goal_joints, action, q_label, sess)
 
-        # train critic given the targets
-        critic_optimization_summaries, _ = network.train_critic(
+        # train the critic (the label is computed from the target networks on the next state), then train the actor
+        # against the updated critic and update the target networks
+        (
+            critic_optimization_summaries,
+            actor_optimization_summaries,
+            (min_label, max_label),
+        ) = network.train_step(
             current_joints,
             workspace_image,
             goal_pose,
             goal_joints,
             action,
-            q_label,
+            reward,
+            terminated,
+            next_joints,
             sess,
         )
-
-        # train actor
-        actor_optimization_summaries, _ = network.train_actor(
-            current_joints, workspace_image, goal_pose, goal_joints, sess
-        )
-
-        # update target networks
-        network.update_target_networks(sess)
+        if print_messages:
+            if max_label > label_limit:
+                print(
+                    "out of range max label: {} limit: {}".format(
+                        max_label, label_limit
+                    )
+                )
+            if min_label < -label_limit:
+                print(
+                    "out of range min label: {} limit: {}".format(
+                        min_label, label_limit
+                    )
+                )
 
         result = [
             critic_optimization_summaries,
@@ -235,7 +217,7 @@ def run_for_config(config, print_messages):
             workspace_id,
         ) = episode_agent_trajectory
         example_trajectory, example_trajectory_poses = episode_example_trajectory
-        example_trajectory = [j[1:] for j in example_trajectory]
+        example_trajectory = np.asarray(example_trajectory, dtype=np.float32)[:, 1:]
         # goal reached always
         status = 3
         # get the states (joints, poses, jacobians), for now, ignore the jacobians.
@@ -244,21 +226,34 @@ def run_for_config(config, print_messages):
             for i in range(len(example_trajectory))
         ]
         # compute the actions by normalized difference between steps
-        actions = [
-            np.array(example_trajectory[i + 1]) - np.array(example_trajectory[i])
-            for i in range(len(example_trajectory) - 1)
-        ]
-        actions = [a / max(np.linalg.norm(a), 0.00001) for a in actions]
+        actions = np.diff(example_trajectory, axis=0)
+        norms = np.linalg.norm(actions, axis=1, keepdims=True)
+        np.maximum(norms, 0.00001, out=norms)
+        actions /= norms
 
-        rewards = [-config["openrave_rl"]["keep_alive_penalty"]] * (
-            len(actions) - 1
-        ) + [1.0]
+        rewards = np.full(
+            len(actions), -config["openrave_rl"]["keep_alive_penalty"], dtype=np.float32
+        )
+        rewards[-1] = 1.0
         return status, states, actions, rewards, goal_pose, goal_joints, workspace_id
 
+    # the actor weights version last sent to the rollout agents, by is_online
+    sent_weights_versions = {True: None, False: None}
+
+    def set_policy_weights(sess, is_online):
+        # no model updates happen until the replay buffer holds a batch, there is no need to send the same weights again
+        if sent_weights_versions[is_online] == network.actor_weights_version:
+            return
+        weights = network.get_actor_weights(sess, is_online=is_online)
+        if is_online and config["general"]["actor_weights_float16"]:
+            # exploration rollouts are noisy anyway, half the bytes are sent to every rollout agent (the test policy
+            # is always sent in full precision)
+            weights = weights.astype(np.float16)
+        rollout_manager.set_policy_weights(weights, is_online=is_online)
+        sent_weights_versions[is_online] = network.actor_weights_version
+
     def do_test(sess, best_model_global_step, best_model_test_success_rate):
-        rollout_manager.set_policy_weights(
-            network.get_actor_weights(sess, is_online=False), is_online=False
-        )
+        set_policy_weights(sess, is_online=False)
         eval_result = trajectory_eval.eval(
             global_step, config["test"]["number_of_episodes"]
         )
@@ -316,7 +311,7 @@ def run_for_config(config, print_messages):
     def do_end_of_run_validation(sess):
         # restores the model first
         best_saver.restore(sess, best_model_path)
-        # set the weights
+        # set the weights (always sent, the restore is not tracked by the actor weights version)
         rollout_manager.set_policy_weights(
             network.get_actor_weights(sess, is_online=False), is_online=False
         )
@@ -354,9 +349,7 @@ def run_for_config(config, print_messages):
         print("final success rate is {}".format(rate))
         return rate
 
-    allowed_batch_episode_editor = (
-        config["model"]["batch_size"] if _is_vision(scenario) else None
-    )
+    allowed_batch_episode_editor = batch_size if _is_vision(scenario) else None
     regular_episode_editor = EpisodeEditor(
         config["model"]["alter_episode"],
         pre_trained_reward,
@@ -381,20 +374,42 @@ def run_for_config(config, print_messages):
         if pre_trained_reward is not None:
             pre_trained_reward.load_weights(sess)
         network.update_target_networks(sess)
+        # the graph does not change during the run, it is exported once and the checkpoints only hold the variables
+        latest_saver.export_meta_graph(os.path.join(saver_dir, "model.meta"))
+        # the global step of the last checkpoint, there is nothing new to save until the model is trained again
+        latest_saved_global_step = None
 
         global_step = 0
         episodes = successful_episodes = collision_episodes = max_len_episodes = 0
         best_model_global_step, best_model_test_success_rate = -1, -1.0
-        for update_index in range(config["general"]["updates_cycle_count"]):
+        episodes_per_update = config["general"]["episodes_per_update"]
+        failed_motion_planner_trajectories = config["model"][
+            "failed_motion_planner_trajectories"
+        ]
+        model_updates_per_cycle = config["general"]["model_updates_per_cycle"]
+        batch_prefetch_size = config["general"]["batch_prefetch_size"]
+        write_train_summaries = config["general"]["write_train_summaries"]
+        test_every_cycles = config["test"]["test_every_cycles"]
+        save_model_every_cycles = config["general"]["save_model_every_cycles"]
+        updates_cycle_count = config["general"]["updates_cycle_count"]
+
+        def start_episodes_collection():
+            # the episodes are generated in the background (with the current weights), while the caller keeps training
+            set_policy_weights(sess, is_online=True)
+            rollout_manager.generate_episodes_async(episodes_per_update, True)
+
+        if updates_cycle_count > 0:
+            start_episodes_collection()
+        for update_index in range(updates_cycle_count):
+            # the episodes of the next cycle are only collected if there is a next cycle. the run can only stop early
+            # after a test, so on test cycles the collection starts once the test is done
+            is_test_cycle = update_index % test_every_cycles == 0
+            has_next_cycle = update_index + 1 < updates_cycle_count
             # collect data
             a = datetime.datetime.now()
-            rollout_manager.set_policy_weights(
-                network.get_actor_weights(sess, is_online=True), is_online=True
-            )
-            episodes_per_update = config["general"]["episodes_per_update"]
-            episode_results = rollout_manager.generate_episodes(
-                episodes_per_update, True
-            )
+            episode_results = rollout_manager.get_async_episodes()
+            if has_next_cycle and not is_test_cycle:
+                start_episodes_collection()
             (
                 episodes_agent_trajectory,
                 episodes_times,
@@ -408,9 +423,6 @@ def run_for_config(config, print_messages):
 
             # process example episodes for failed interactions
             altered_motion_planner_episodes = []
-            failed_motion_planner_trajectories = config["model"][
-                "failed_motion_planner_trajectories"
-            ]
             if failed_motion_planner_trajectories > 0:
                 # take a small number of failed motion plans
                 failed_episodes_indices = [
@@ -433,39 +445,32 @@ def run_for_config(config, print_messages):
 
             # add to replay buffer
             hindsight_policy.append_to_replay_buffer(
-                list(altered_episodes) + list(altered_motion_planner_episodes)
+                itertools.chain(altered_episodes, altered_motion_planner_episodes)
             )
 
-            # compute times
-            total_find_trajectory_time = None
-            total_rollout_time = None
-            for episode_times in episodes_times:
-                # update the times
-                find_trajectory_time, rollout_time = episode_times
-                if total_find_trajectory_time is None:
-                    total_find_trajectory_time = find_trajectory_time
-                else:
-                    total_find_trajectory_time += find_trajectory_time
-                if total_rollout_time is None:
-                    total_rollout_time = rollout_time
-                else:
-                    total_rollout_time += rollout_time
-
-            # compute counters
-            for altered_episode in altered_episodes:
-                status = altered_episode[0]
-                episodes += 1
-                if status == 1:
-                    max_len_episodes += 1
-                elif status == 2:
-                    collision_episodes += 1
-                elif status == 3:
-                    successful_episodes += 1
+            # compute counters (status 1: max length, 2: collision, 3: success)
+            statuses = np.fromiter(
+                (altered_episode[0] for altered_episode in altered_episodes),
+                dtype=np.int8,
+                count=len(altered_episodes),
+            )
+            status_counts = np.bincount(statuses, minlength=4)
+            episodes += len(altered_episodes)
+            max_len_episodes += int(status_counts[1])
+            collision_episodes += int(status_counts[2])
+            successful_episodes += int(status_counts[3])
 
             b = datetime.datetime.now()
-            print("data collection took: {}".format(b - a))
-            print("find trajectory took: {}".format(total_find_trajectory_time))
-            print("rollout time took: {}".format(total_rollout_time))
+            if print_messages:
+                # compute times (only needed for printing)
+                find_trajectory_times, rollout_times = zip(*episodes_times)
+                total_find_trajectory_time = sum(
+                    find_trajectory_times, datetime.timedelta()
+                )
+                total_rollout_time = sum(rollout_times, datetime.timedelta())
+                print("data collection took: {}".format(b - a))
+                print("find trajectory took: {}".format(total_find_trajectory_time))
+                print("rollout time took: {}".format(total_rollout_time))
             print_state(
                 "train",
                 episodes,
@@ -475,11 +480,17 @@ def run_for_config(config, print_messages):
             )
 
             # do updates
-            if replay_buffer.size() > config["model"]["batch_size"]:
+            if replay_buffer.size() > batch_size:
                 a = datetime.datetime.now()
-                for _ in range(config["general"]["model_updates_per_cycle"]):
-                    summaries = update_model(sess, global_step)
-                    if global_step % config["general"]["write_train_summaries"] == 0:
+                # the next batches are sampled in the background while the current batch trains
+                training_batches = BatchPrefetcher(
+                    sample_training_batch,
+                    model_updates_per_cycle,
+                    prefetch_size=batch_prefetch_size,
+                )
+                for replay_buffer_batch, workspace_image in training_batches:
+                    summaries = update_model(sess, replay_buffer_batch, workspace_image)
+                    if global_step % write_train_summaries == 0:
                         summaries_collector.write_train_episode_summaries(
                             sess,
                             global_step,
@@ -493,23 +504,32 @@ def run_for_config(config, print_messages):
                         )
                     global_step += 1
                 b = datetime.datetime.now()
-                print("update took: {}".format(b - a))
+                if print_messages:
+                    print("update took: {}".format(b - a))
 
             # test if needed
-            if update_index % config["test"]["test_every_cycles"] == 0:
+            if is_test_cycle:
                 is_best, best_model_global_step, best_model_test_success_rate = do_test(
                     sess, best_model_global_step, best_model_test_success_rate
                 )
                 if is_best:
                     best_model_path = best_saver.save(
-                        sess, os.path.join(saver_dir, "best"), global_step=global_step
+                        sess,
+                        os.path.join(saver_dir, "best"),
+                        global_step=global_step,
+                        write_meta_graph=False,
                     )
-            if update_index % config["general"]["save_model_every_cycles"] == 0:
+            if (
+                update_index % save_model_every_cycles == 0
+                and latest_saved_global_step != global_step
+            ):
                 latest_saver.save(
                     sess,
                     os.path.join(saver_dir, "last_iteration"),
                     global_step=global_step,
+                    write_meta_graph=False,
                 )
+                latest_saved_global_step = global_step
             # see if max score reached (even if validation is not 100%, there will no longer be any model updates...)
             if best_model_test_success_rate > 0.99999:
                 print(
@@ -518,6 +538,8 @@ def run_for_config(config, print_messages):
                     )
                 )
                 break
+            if has_next_cycle and is_test_cycle:
+                start_episodes_collection()
 
         # final test at the end
         is_best, best_model_global_step, best_model_test_success_rate = do_test(
@@ -525,11 +547,15 @@ def run_for_config(config, print_messages):
         )
         if is_best:
             best_model_path = best_saver.save(
-                sess, os.path.join(saver_dir, "best"), global_step=global_step
+                sess,
+                os.path.join(saver_dir, "best"),
+                global_step=global_step,
+                write_meta_graph=False,
             )
 
         # get a validation rate for the best recorded model
         validation_rate = do_end_of_run_validation(sess)
+        summaries_collector.close()
 
     last_message = "best model stats at step {} has success rate of {} and validation success rate of {}".format(
         best_model_global_step, best_model_test_success_rate, validation_rate
@@ -544,7 +570,7 @@ def run_for_config(config, print_messages):
         completed_trajectories_dir, "test_results.test_results_pkl"
     )
     with bz2.BZ2File(test_results_file, "w") as compressed_file:
-        pickle.dump(test_results, compressed_file)
+        pickle.dump(test_results, compressed_file, pickle.HIGHEST_PROTOCOL)
 
     rollout_manager.end()
     return test_results
@@ -2,8 +2,9 @@ import tensorflow as tf
 
 
 class DqnModel:
-    def __init__(self, prefix):
+    def __init__(self, prefix, data_format="channels_last"):
         self.prefix = "{}_dqn".format(prefix)
+        self.data_format = data_format
 
     def predict(self, workspace_image, reuse_flag):
         conv1 = tf.layers.conv2d(
@@ -14,6 +15,7 @@ class DqnModel:
             padding="same",
             activation=tf.nn.relu,
             use_bias=True,
+            data_format=self.data_format,
             name="{}_conv1".format(self.prefix),
             reuse=reuse_flag,
         )
@@ -25,9 +27,13 @@ class DqnModel:
             padding="same",
             activation=tf.nn.relu,
             use_bias=True,
+            data_format=self.data_format,
             name="{}_conv2".format(self.prefix),
             reuse=reuse_flag,
         )
+        if self.data_format == "channels_first":
+            # flatten in channels last order so the dense weights do not depend on the data format
+            conv2 = tf.transpose(conv2, [0, 2, 3, 1])
         # conv3 = tf.layers.conv2d(conv2, 64, 3, 1, padding='same', activation=tf.nn.relu, use_bias=True)
         # flat = tf.layers.flatten(conv3)
         flat = tf.layers.flatten(conv2, name="{}_flat".format(self.prefix))
@@ -30,34 +30,54 @@ class EpisodeEditor:
         self.images_buffer = None
 
     def _clear_buffers(self):
-        self.current_joints_buffer = np.zeros(
-            (0, self.joints_dimension), dtype=np.float32
-        )
-        self.goal_joints_buffer = np.zeros((0, self.joints_dimension), dtype=np.float32)
-        self.actions_buffer = np.zeros((0, self.joints_dimension), dtype=np.float32)
-        self.goal_poses_buffer = np.zeros((0, self.pose_dimension), dtype=np.float32)
+        # the inputs of every episode are collected in lists, and concatenated once all the episodes were added (see
+        # _concatenate_buffers)
+        self.current_joints_buffer = [
+            np.zeros((0, self.joints_dimension), dtype=np.float32)
+        ]
+        self.goal_joints_buffer = [
+            np.zeros((0, self.joints_dimension), dtype=np.float32)
+        ]
+        self.actions_buffer = [np.zeros((0, self.joints_dimension), dtype=np.float32)]
+        self.goal_poses_buffer = [np.zeros((0, self.pose_dimension), dtype=np.float32)]
         if self.alter_episode_mode == 2:
-            self.status_buffer = np.zeros((0, self.status_dimension), dtype=np.float32)
+            self.status_buffer = [
+                np.zeros((0, self.status_dimension), dtype=np.float32)
+            ]
         if self.image_cache is not None:
-            self.images_buffer = np.zeros(
-                (0, self.image_dimension[0], self.image_dimension[1]), dtype=np.int32
-            )
+            self.images_buffer = [
+                np.zeros(
+                    (0, self.image_dimension[0], self.image_dimension[1]),
+                    dtype=np.float32,
+                )
+            ]
 
     def _append_to_buffers(
         self, current_joints, goal_joints, actions, goal_poses, status, images
     ):
-        self.current_joints_buffer = np.append(
-            self.current_joints_buffer, current_joints, axis=0
-        )
-        self.goal_joints_buffer = np.append(
-            self.goal_joints_buffer, goal_joints, axis=0
-        )
-        self.actions_buffer = np.append(self.actions_buffer, actions, axis=0)
-        self.goal_poses_buffer = np.append(self.goal_poses_buffer, goal_poses, axis=0)
+        self.current_joints_buffer.append(np.asarray(current_joints, dtype=np.float32))
+        self.goal_joints_buffer.append(np.asarray(goal_joints, dtype=np.float32))
+        self.actions_buffer.append(np.asarray(actions, dtype=np.float32))
+        self.goal_poses_buffer.append(np.asarray(goal_poses, dtype=np.float32))
         if self.status_buffer is not None:
-            self.status_buffer = np.append(self.status_buffer, status, axis=0)
+            self.status_buffer.append(status)
         if self.images_buffer is not None:
-            self.images_buffer = np.append(self.images_buffer, images, axis=0)
+            self.images_buffer.append(np.asarray(images, dtype=np.float32))
+
+    @staticmethod
+    def _repeat(value, count):
+        value = np.asarray(value, dtype=np.float32)
+        return np.broadcast_to(value, (count,) + value.shape)
+
+    def _concatenate_buffers(self):
+        self.current_joints_buffer = np.concatenate(self.current_joints_buffer, axis=0)
+        self.goal_joints_buffer = np.concatenate(self.goal_joints_buffer, axis=0)
+        self.actions_buffer = np.concatenate(self.actions_buffer, axis=0)
+        self.goal_poses_buffer = np.concatenate(self.goal_poses_buffer, axis=0)
+        if self.status_buffer is not None:
+            self.status_buffer = np.concatenate(self.status_buffer, axis=0)
+        if self.images_buffer is not None:
+            self.images_buffer = np.concatenate(self.images_buffer, axis=0)
 
     def _predict_buffers_by_batches(self, sess):
         if self.allowed_batch is None:
@@ -72,8 +92,9 @@ class EpisodeEditor:
                 images=self.images_buffer,
             )
         current_index = 0
-        fake_rewards = np.zeros((0, 1), dtype=np.float32)
-        fake_status_prob = np.zeros((0, self.status_dimension), dtype=np.float32)
+        # the results of every batch are collected and concatenated once
+        fake_rewards = [np.zeros((0, 1), dtype=np.float32)]
+        fake_status_prob = [np.zeros((0, self.status_dimension), dtype=np.float32)]
         while current_index < len(self.current_joints_buffer):
             current_prediction_result = self.pre_trained_reward.make_prediction(
                 sess,
@@ -93,11 +114,12 @@ class EpisodeEditor:
                 ],
             )
             current_index += self.allowed_batch
-            fake_rewards = np.append(fake_rewards, current_prediction_result[0], axis=0)
-            fake_status_prob = np.append(
-                fake_status_prob, current_prediction_result[1], axis=0
-            )
-        return fake_rewards, fake_status_prob
+            fake_rewards.append(current_prediction_result[0])
+            fake_status_prob.append(current_prediction_result[1])
+        return (
+            np.concatenate(fake_rewards, axis=0),
+            np.concatenate(fake_status_prob, axis=0),
+        )
 
     def process_episodes(self, episodes, sess):
         # no alteration
@@ -107,9 +129,10 @@ class EpisodeEditor:
         # clear reward network input buffers
         self._clear_buffers()
         episode_start_indices = []
+        episode_start_index = 0
         for episode_agent_trajectory in episodes:
             # save the start index for every episode
-            episode_start_indices.append(len(self.current_joints_buffer))
+            episode_start_indices.append(episode_start_index)
             # add data to buffers
             (
                 status,
@@ -126,18 +149,23 @@ class EpisodeEditor:
                 one_hot_status = np.zeros((len(rewards), 3), dtype=np.float32)
                 one_hot_status[:-1, 0] = 1.0
                 one_hot_status[-1, 2] = 1.0
+            # the values shared by all the transitions of the episode are broadcast (read only views, the data is
+            # only copied when the buffers are concatenated)
             images = None
             if self.images_buffer is not None:
-                image = self.image_cache.get_image(workspace_id)
-                images = [image] * len(actions)
+                images = self._repeat(
+                    self.image_cache.get_image(workspace_id), len(actions)
+                )
             self._append_to_buffers(
                 current_joints,
-                [goal_joints] * len(actions),
+                self._repeat(goal_joints, len(actions)),
                 actions,
-                [goal_pose] * len(actions),
+                self._repeat(goal_pose, len(actions)),
                 one_hot_status,
                 images,
             )
+            episode_start_index += len(actions)
+        self._concatenate_buffers()
         # get the results by batch:
         fake_rewards, fake_status_prob = self._predict_buffers_by_batches(sess)
 
@@ -173,13 +201,13 @@ class EpisodeEditor:
                 relevant_fake_status = fake_status_prob[
                     episode_start_index : episode_start_index + len(rewards)
                 ]
-                fake_status = np.argmax(np.array(relevant_fake_status), axis=1)
+                fake_status = np.argmax(relevant_fake_status, axis=1)
                 fake_status += 1
-                # iterate over approximated episode and see if truncation is needed
-                truncation_index = 0
-                for truncation_index in range(len(fake_status)):
-                    if fake_status[truncation_index] != 1:
-                        break
+                # truncate the approximated episode at the first transition that is not free (or keep all of it)
+                not_free = fake_status != 1
+                truncation_index = (
+                    int(np.argmax(not_free)) if not_free.any() else len(fake_status) - 1
+                )
                 # return the status of the last transition, truncated list of states and actions, the fake rewards (also
                 # truncated) and the goal parameters as-is.
                 altered_status = fake_status[truncation_index]
@@ -1,6 +1,22 @@
 import numpy as np
+from collections import namedtuple
 from potential_point import PotentialPoint
 
+# the extra transitions are kept field by field, every field is a list with an entry per transition
+AugmentedBuffer = namedtuple(
+    "AugmentedBuffer",
+    [
+        "goal_pose",
+        "goal_joints",
+        "workspace_id",
+        "current_state",
+        "action_used",
+        "current_reward",
+        "is_terminal",
+        "next_state",
+    ],
+)
+
 
 class HindsightPolicy:
     def __init__(self, config, replay_buffer, predict_reward_and_status_func):
@@ -9,10 +25,15 @@ class HindsightPolicy:
         self.target_potential_point = PotentialPoint.from_config(config)[-1]
         self.predict_reward_and_status_func = predict_reward_and_status_func
         # the following buffer saves the transition we are about to add
-        self.augmented_buffer = []
+        self.augmented_buffer = self._create_augmented_buffer()
+
+    @staticmethod
+    def _create_augmented_buffer():
+        return AugmentedBuffer(*[[] for _ in AugmentedBuffer._fields])
 
     def append_to_replay_buffer(self, episodes):
-        self.augmented_buffer = []
+        # episodes can be any iterable, they are consumed once
+        self.augmented_buffer = self._create_augmented_buffer()
         for episode in episodes:
             self._append_to_replay_buffer_single_episode(episode)
         self._score_extra_data_and_add_to_buffer()
@@ -39,55 +60,24 @@ class HindsightPolicy:
             self._add_extra_data(i, status, states, actions, rewards, workspace_id)
 
     def _score_extra_data_and_add_to_buffer(self):
-        if len(self.augmented_buffer) == 0:
+        buffer = self.augmented_buffer
+        if len(buffer.action_used) == 0:
             return
         if self.config["hindsight"]["score_with_reward_model"]:
-            rewards = self.predict_reward_and_status_func(self.augmented_buffer)
-            for i, transition in enumerate(self.augmented_buffer):
-                (
-                    goal_pose,
-                    goal_joints,
-                    workspace_id,
-                    current_state,
-                    action_used,
-                    current_reward,
-                    is_terminal,
-                    next_state,
-                ) = transition
-                self.replay_buffer.add(
-                    goal_pose,
-                    goal_joints,
-                    workspace_id,
-                    current_state,
-                    action_used,
-                    rewards[i],
-                    is_terminal,
-                    next_state,
-                )
+            rewards = self.predict_reward_and_status_func(buffer)
         else:
-            for transition in self.augmented_buffer:
-                (
-                    goal_pose,
-                    goal_joints,
-                    workspace_id,
-                    current_state,
-                    action_used,
-                    current_reward,
-                    is_terminal,
-                    next_state,
-                ) = transition
-                self.replay_buffer.add(
-                    goal_pose,
-                    goal_joints,
-                    workspace_id,
-                    current_state,
-                    action_used,
-                    current_reward,
-                    is_terminal,
-                    next_state,
-                )
-            # for transition in self.augmented_buffer:
-            #     self.replay_buffer.add(*zip(transition))
+            rewards = buffer.current_reward
+        for i in range(len(buffer.action_used)):
+            self.replay_buffer.add(
+                buffer.goal_pose[i],
+                buffer.goal_joints[i],
+                buffer.workspace_id[i],
+                buffer.current_state[i],
+                buffer.action_used[i],
+                rewards[i],
+                buffer.is_terminal[i],
+                buffer.next_state[i],
+            )
 
     def _add_extra_data(
         self, current_state_index, status, states, actions, rewards, workspace_id
@@ -188,4 +178,5 @@ class HindsightPolicy:
             is_terminal,
             next_state,
         )
-        self.augmented_buffer.append(transition)
+        for field, value in zip(self.augmented_buffer, transition):
+            field.append(value)
@@ -16,7 +16,7 @@ class ImageCacheItem:
 
 
 class ImageCache:
-    def __init__(self, params_directory, create_images=True):
+    def __init__(self, params_directory, create_images=True, images_dtype=None):
         self.items = {}
         self._create_images = create_images
 
@@ -41,10 +41,35 @@ class ImageCache:
                     filename, full_file_path, params, np_array
                 )
 
+        # workspaces are also identified by their index in a sorted order, all the images are kept in a single array
+        # by that order so a batch of images can be gathered at once
+        self._workspace_ids = sorted(self.items.keys())
+        self._workspace_id_to_index = {
+            workspace_id: i for i, workspace_id in enumerate(self._workspace_ids)
+        }
+        self._images = None
+        if create_images and len(self._workspace_ids) > 0:
+            self._images = np.stack(
+                [self.items[k].np_array for k in self._workspace_ids], axis=0
+            )
+            # converting once here saves converting every gathered batch during training
+            if images_dtype is not None:
+                self._images = self._images.astype(images_dtype)
+            # the items share the memory of the stacked array
+            for i, workspace_id in enumerate(self._workspace_ids):
+                self.items[workspace_id].np_array = self._images[i]
+
     def get_image(self, workspace_id):
         assert self._create_images
         return self.items[workspace_id].np_array
 
+    def get_index(self, workspace_id):
+        return self._workspace_id_to_index[workspace_id]
+
+    def get_image_batch(self, workspace_indices):
+        assert self._create_images
+        return self._images.take(workspace_indices, axis=0)
+
     @staticmethod
     def _figure_to_nparray(fig):
         fig.canvas.draw()
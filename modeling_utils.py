@@ -9,3 +9,10 @@ def get_activation(activation):
     if activation == "elu":
         return tf.nn.elu
     return None
+
+
+def get_image_data_format(config):
+    # convolutions run faster on gpu with channels first (NCHW), tensorflow only supports channels last on cpu
+    if config["model"]["images_channels_first"]:
+        return "channels_first"
+    return "channels_last"
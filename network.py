@@ -4,7 +4,7 @@ import tensorflow as tf
 import tensorflow.contrib.layers as layers
 
 from dqn_model import DqnModel
-from modeling_utils import get_activation
+from modeling_utils import get_activation, get_image_data_format
 from potential_point import PotentialPoint
 
 
@@ -28,6 +28,10 @@ class Network(object):
         self.number_of_joints = number_of_joints
         self.pose_dimensions = pose_dimensions
 
+        # incremented whenever a training step may change the actor weights (online or target), lets the caller skip
+        # sending unchanged weights to the rollout agents
+        self.actor_weights_version = 0
+
         # generate inputs
         all_inputs = self._create_inputs()
         self.joints_inputs = all_inputs[0]
@@ -35,10 +39,16 @@ class Network(object):
         self.goal_joints_inputs = all_inputs[2]
         self.goal_pose_inputs = all_inputs[3]
 
-        # images for vision
+        # images for vision (rollout agents may run on cpu, where only channels last is supported)
+        self.image_data_format = (
+            "channels_last" if is_rollout_agent else get_image_data_format(config)
+        )
         self.images_3d = None
         if self.workspace_image_inputs is not None:
-            self.images_3d = tf.expand_dims(self.workspace_image_inputs, axis=-1)
+            channels_axis = 1 if self.image_data_format == "channels_first" else -1
+            self.images_3d = tf.expand_dims(
+                self.workspace_image_inputs, axis=channels_axis
+            )
 
         # since we take partial derivatives w.r.t subsets of the parameters, we always need to remember which parameters
         # are currently being added. note that this also causes the model to be non thread safe, therefore the creation
@@ -53,15 +63,12 @@ class Network(object):
         online_actor_tanh = actor_results[1]
         self.online_actor_params = tf.trainable_variables()[variable_count:]
 
-        # create placeholders and assign ops to set these weights manually (used by rollout agents)
-        self.online_actor_parameter_weights_placeholders = {
-            var.name: tf.placeholder(tf.float32, var.get_shape())
-            for var in self.online_actor_params
-        }
-        self.online_actor_parameters_assign_ops = [
-            tf.assign(var, self.online_actor_parameter_weights_placeholders[var.name])
-            for var in self.online_actor_params
-        ]
+        # create ops to get and set these weights manually as a single flat array (used by rollout agents)
+        (
+            self.online_actor_flat_weights,
+            self.online_actor_flat_weights_placeholder,
+            self.online_actor_flat_weights_assign_op,
+        ) = self._create_flat_weights_ops(self.online_actor_params)
 
         # target actor network
         variable_count = len(tf.trainable_variables())
@@ -71,15 +78,12 @@ class Network(object):
         self.target_action = actor_results[0]
         self.target_actor_params = tf.trainable_variables()[variable_count:]
 
-        # create placeholders and assign ops to set these weights manually (used by rollout agents)
-        self.target_actor_parameter_weights_placeholders = {
-            var.name: tf.placeholder(tf.float32, var.get_shape())
-            for var in self.target_actor_params
-        }
-        self.target_actor_parameters_assign_ops = [
-            tf.assign(var, self.target_actor_parameter_weights_placeholders[var.name])
-            for var in self.target_actor_params
-        ]
+        # create ops to get and set these weights manually as a single flat array (used by rollout agents)
+        (
+            self.target_actor_flat_weights,
+            self.target_actor_flat_weights_placeholder,
+            self.target_actor_flat_weights_assign_op,
+        ) = self._create_flat_weights_ops(self.target_actor_params)
 
         # this is as much as a rollout agent needs
         if is_rollout_agent:
@@ -111,13 +115,9 @@ class Network(object):
             )  # make sure no new parameters were added
 
         # periodically update target actor with online actor weights
-        self.update_actor_target_params = [
-            self.target_actor_params[i].assign(
-                tf.multiply(self.online_actor_params[i], tau)
-                + tf.multiply(self.target_actor_params[i], 1.0 - tau)
-            )
-            for i in range(len(self.target_actor_params))
-        ]
+        self.update_actor_target_params = self._create_target_update_ops(
+            self.online_actor_params, self.target_actor_params, tau
+        )
 
         # create inputs for the critic and reward network when using a constant action
         self.action_inputs = tf.placeholder(
@@ -167,13 +167,37 @@ class Network(object):
         target_critic_params = tf.trainable_variables()[variable_count:]
 
         # periodically update target critic with online critic weights
-        self.update_critic_target_params = [
-            target_critic_params[i].assign(
-                tf.multiply(online_critic_params[i], tau)
-                + tf.multiply(target_critic_params[i], 1.0 - tau)
-            )
-            for i in range(len(target_critic_params))
-        ]
+        self.update_critic_target_params = self._create_target_update_ops(
+            online_critic_params, target_critic_params, tau
+        )
+
+        # the label of the critic is computed by the target networks on the next state:
+        # r + (1 - terminated) * gamma * q'(s', mu'(s'))
+        self.next_joints_inputs = tf.placeholder(
+            tf.float32, (None, self.number_of_joints), name="next_joints_inputs"
+        )
+        self.reward_inputs = tf.placeholder(tf.float32, (None,), name="reward_inputs")
+        self.terminated_inputs = tf.placeholder(
+            tf.float32, (None,), name="terminated_inputs"
+        )
+        variable_count = len(tf.trainable_variables())
+        next_state_target_action = self._create_actor_network(
+            self.next_joints_inputs, is_online=False, reuse_flag=True
+        )[0]
+        next_state_target_q = self._create_critic_network(
+            self.next_joints_inputs,
+            next_state_target_action,
+            is_online=False,
+            reuse_flag=True,
+            add_regularization_loss=False,
+        )
+        assert variable_count == len(
+            tf.trainable_variables()
+        )  # make sure no new parameters were added
+        include_next_state = tf.expand_dims(1.0 - self.terminated_inputs, 1)
+        q_label = tf.expand_dims(self.reward_inputs, 1) + (
+            gamma * include_next_state * tf.stop_gradient(next_state_target_q)
+        )
 
         (
             self.fixed_action_reward,
@@ -214,8 +238,11 @@ class Network(object):
             )
             assert variable_count == len(tf.trainable_variables())
 
-        # the label to use to train the online critic network
-        self.scalar_label = tf.placeholder(tf.float32, [None, 1])
+        # the label to use to train the online critic network (computed in the graph unless fed)
+        self.scalar_label = tf.placeholder_with_default(q_label, [None, 1])
+        self.scalar_label_range = tf.stack(
+            [tf.reduce_min(self.scalar_label), tf.reduce_max(self.scalar_label)]
+        )
 
         batch_size = tf.cast(tf.shape(self.joints_inputs)[0], tf.float32)
 
@@ -325,6 +352,19 @@ class Network(object):
             merge_list.append(tanh_loss_summary)
         self.actor_optimization_summaries = tf.summary.merge(merge_list)
 
+        # the second half of a training step (see train_step): the actor is trained against the already updated
+        # critic, and only then the target networks are updated
+        with tf.control_dependencies([self.optimize_actor]):
+            update_critic_target_params = self._create_target_update_ops(
+                online_critic_params, target_critic_params, tau
+            )
+            update_actor_target_params = self._create_target_update_ops(
+                self.online_actor_params, self.target_actor_params, tau
+            )
+        self.optimize_actor_and_target_networks = tf.group(
+            update_critic_target_params, update_actor_target_params
+        )
+
     @staticmethod
     def _compute_termination_from_status(status_logits):
         free_space_logits, collision_logits, goal_logits = tf.split(
@@ -336,6 +376,23 @@ class Network(object):
         termination_probability = tf.split(softmax_output, 2, axis=1)[1]
         return termination_probability
 
+    @staticmethod
+    def _create_flat_weights_ops(params):
+        # the weights are concatenated in the order of the params, so networks with the same structure can exchange
+        # the flat arrays
+        flat_weights = tf.concat([tf.reshape(var, [-1]) for var in params], axis=0)
+        flat_weights_placeholder = tf.placeholder(tf.float32, flat_weights.get_shape())
+        sizes = [var.get_shape().num_elements() for var in params]
+        assign_op = tf.group(
+            *[
+                tf.assign(var, tf.reshape(weights, var.get_shape()))
+                for var, weights in zip(
+                    params, tf.split(flat_weights_placeholder, sizes)
+                )
+            ]
+        )
+        return flat_weights, flat_weights_placeholder, assign_op
+
     @staticmethod
     def _optimize_by_loss(loss, parameters_to_optimize, learning_rate, gradient_limit):
         optimizer = tf.train.AdamOptimizer(learning_rate)
@@ -351,6 +408,16 @@ class Network(object):
         optimize_op = optimizer.apply_gradients(zip(gradients, variables))
         return initial_gradients_norm, clipped_gradients_norm, optimize_op
 
+    @staticmethod
+    def _create_target_update_ops(online_params, target_params, tau):
+        # polyak averaging as a single op: target <- target - tau * (target - online)
+        return tf.group(
+            *[
+                tf.assign_sub(target, tau * (target - online))
+                for online, target in zip(online_params, target_params)
+            ]
+        )
+
     def _create_inputs(self):
         joints_inputs = tf.placeholder(
             tf.float32, (None, self.number_of_joints), name="joints_inputs"
@@ -380,7 +447,7 @@ class Network(object):
         features = [current_joints, self.goal_joints_inputs]
         # features.append(self.goal_joints_inputs - current_joints)
         if self.images_3d is not None:
-            perception = DqnModel(prefix)
+            perception = DqnModel(prefix, self.image_data_format)
             features.append(perception.predict(self.images_3d, reuse_flag))
         if self.goal_pose_inputs is not None:
             features.append(self.goal_pose_inputs)
@@ -523,6 +590,52 @@ class Network(object):
             [self.critic_optimization_summaries, self.optimize_critic], feed_dictionary
         )
 
+    def train_step(
+        self,
+        joint_inputs,
+        workspace_image_inputs,
+        goal_pose_inputs,
+        goal_joints_inputs,
+        action_inputs,
+        reward_inputs,
+        terminated_inputs,
+        next_joint_inputs,
+        sess,
+    ):
+        # a training step in two session calls: first the critic is trained (the label is computed in the graph from
+        # the target networks), then the actor is trained against the updated critic and the target networks are
+        # updated. returns the critic and actor summaries and the (min, max) range of the critic label
+        critic_feed_dictionary = self._generate_feed_dictionary(
+            joint_inputs,
+            workspace_image_inputs,
+            goal_pose_inputs,
+            goal_joints_inputs,
+            action_inputs,
+        )
+        critic_feed_dictionary[self.reward_inputs] = reward_inputs
+        critic_feed_dictionary[self.terminated_inputs] = terminated_inputs
+        critic_feed_dictionary[self.next_joints_inputs] = next_joint_inputs
+        critic_summaries, label_range, _ = sess.run(
+            [
+                self.critic_optimization_summaries,
+                self.scalar_label_range,
+                self.optimize_critic,
+            ],
+            critic_feed_dictionary,
+        )
+        actor_feed_dictionary = self._generate_feed_dictionary(
+            joint_inputs, workspace_image_inputs, goal_pose_inputs, goal_joints_inputs
+        )
+        self.actor_weights_version += 1
+        actor_summaries, _ = sess.run(
+            [
+                self.actor_optimization_summaries,
+                self.optimize_actor_and_target_networks,
+            ],
+            actor_feed_dictionary,
+        )
+        return critic_summaries, actor_summaries, label_range
+
     def train_actor(
         self,
         joint_inputs,
@@ -534,6 +647,7 @@ class Network(object):
         feed_dictionary = self._generate_feed_dictionary(
             joint_inputs, workspace_image_inputs, goal_pose_inputs, goal_joints_inputs
         )
+        self.actor_weights_version += 1
         return sess.run(
             [self.actor_optimization_summaries, self.optimize_actor], feed_dictionary
         )
@@ -593,25 +707,31 @@ class Network(object):
         )
 
     def get_actor_weights(self, sess, is_online):
-        weights = self.online_actor_params if is_online else self.target_actor_params
-        return sess.run(weights)
+        # returns all the weights of the actor as a single flat array
+        flat_weights = (
+            self.online_actor_flat_weights
+            if is_online
+            else self.target_actor_flat_weights
+        )
+        return sess.run(flat_weights)
 
     def set_actor_weights(self, sess, weights, is_online):
-        params = self.online_actor_params if is_online else self.target_actor_params
-        placeholders = (
-            self.online_actor_parameter_weights_placeholders
+        # weights is a flat array, as returned by get_actor_weights (possibly in lower precision)
+        placeholder = (
+            self.online_actor_flat_weights_placeholder
             if is_online
-            else self.target_actor_parameter_weights_placeholders
+            else self.target_actor_flat_weights_placeholder
         )
-        feed = {placeholders[var.name]: weights[i] for i, var in enumerate(params)}
-        ops = (
-            self.online_actor_parameters_assign_ops
+        assign_op = (
+            self.online_actor_flat_weights_assign_op
             if is_online
-            else self.target_actor_parameters_assign_ops
+            else self.target_actor_flat_weights_assign_op
         )
-        sess.run(ops, feed)
+        sess.run(assign_op, {placeholder: np.asarray(weights, dtype=np.float32)})
+        self.actor_weights_version += 1
 
     def update_target_networks(self, sess):
+        self.actor_weights_version += 1
         sess.run([self.update_critic_target_params, self.update_actor_target_params])
 
     def _print(self, header, array):
@@ -7,7 +7,7 @@ import tensorflow as tf
 import tensorflow.contrib.layers as tf_layers
 
 from dqn_model import DqnModel
-from modeling_utils import get_activation
+from modeling_utils import get_activation, get_image_data_format
 
 
 class PreTrainedReward:
@@ -16,6 +16,7 @@ class PreTrainedReward:
 
         self.config = config
         self.is_vision_enabled = "vision" in config["general"]["scenario"]
+        self.image_data_format = get_image_data_format(config)
 
         self.joints_inputs = tf.placeholder(tf.float32, (None, 4), name="joints_inputs")
         self.goal_joints_inputs = tf.placeholder(
@@ -26,7 +27,10 @@ class PreTrainedReward:
             self.workspace_image_inputs = tf.placeholder(
                 tf.float32, (None, 55, 111), name="workspace_image_inputs"
             )
-            self.images_3d = tf.expand_dims(self.workspace_image_inputs, axis=-1)
+            channels_axis = 1 if self.image_data_format == "channels_first" else -1
+            self.images_3d = tf.expand_dims(
+                self.workspace_image_inputs, axis=channels_axis
+            )
         self.goal_pose_inputs = tf.placeholder(
             tf.float32, (None, 2), name="goal_pose_inputs"
         )
@@ -105,7 +109,9 @@ class PreTrainedReward:
         )
         # add vision if needed
         if self.is_vision_enabled:
-            visual_inputs = DqnModel(name_prefix).predict(images_3d, self._reuse_flag)
+            visual_inputs = DqnModel(name_prefix, self.image_data_format).predict(
+                images_3d, self._reuse_flag
+            )
             current = tf.concat((current, visual_inputs), axis=1)
         for i, layer_size in enumerate(layers):
             _activation = (
@@ -195,19 +201,22 @@ class PreTrainedReward:
         images=None,
         all_transition_labels=None,
     ):
+        # the whole batch is stacked once into float arrays (a no-op for inputs that are already arrays)
         feed = {
-            self.joints_inputs: all_start_joints,
-            self.goal_joints_inputs: all_goal_joints,
-            self.action_inputs: all_actions,
+            self.joints_inputs: np.asarray(all_start_joints, dtype=np.float32),
+            self.goal_joints_inputs: np.asarray(all_goal_joints, dtype=np.float32),
+            self.action_inputs: np.asarray(all_actions, dtype=np.float32),
         }
         if self.goal_pose_inputs is not None:
-            feed[self.goal_pose_inputs] = all_goal_poses
+            feed[self.goal_pose_inputs] = np.asarray(all_goal_poses, dtype=np.float32)
         if self.is_vision_enabled:
             assert images is not None
             assert images[0] is not None
-            feed[self.workspace_image_inputs] = images
+            feed[self.workspace_image_inputs] = np.asarray(images, dtype=np.float32)
         if all_transition_labels is not None:
-            feed[self.transition_label] = all_transition_labels
+            feed[self.transition_label] = np.asarray(
+                all_transition_labels, dtype=np.float32
+            )
         return feed
 
 
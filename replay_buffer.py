@@ -1,12 +1,47 @@
-from collections import deque
-import random
+import numpy as np
+
+from potential_point import PotentialPoint
 
 
 class ReplayBuffer(object):
-    def __init__(self, config):
+    def __init__(self, config, number_of_joints=4, pose_dimensions=2, image_cache=None):
         self.buffer_size = config["model"]["buffer_size"]
+        # workspaces are stored by their index in the image cache (-1 if there is no image cache)
+        self.image_cache = image_cache
         self.count = 0
-        self.buffer = deque()
+        # the buffer samples with its own generator: batches are sampled in a background thread (see
+        # BatchPrefetcher), so the sampling order does not depend on other users of the global numpy generator. the
+        # global generator is seeded with random_seed, the buffer uses a different seed so the streams are not the same
+        self._random = np.random.RandomState(config["general"]["random_seed"] + 1)
+        # the index the next transition is written to, once the buffer is full the oldest transition is overwritten
+        self._next_index = 0
+
+        # the poses of a state are kept in a single tensor, ordered by the potential points in the config
+        self.potential_points_order = [
+            p.tuple for p in PotentialPoint.from_config(config)
+        ]
+        poses_shape = (len(self.potential_points_order), pose_dimensions)
+
+        # every field is kept in its own preallocated array (struct of arrays)
+        self.goal_pose = np.zeros((self.buffer_size, pose_dimensions), dtype=np.float32)
+        self.goal_joints = np.zeros(
+            (self.buffer_size, number_of_joints), dtype=np.float32
+        )
+        self.workspace_index = np.full(self.buffer_size, -1, dtype=np.int32)
+        self.current_joints = np.zeros(
+            (self.buffer_size, number_of_joints), dtype=np.float32
+        )
+        self.current_poses = np.zeros(
+            (self.buffer_size,) + poses_shape, dtype=np.float32
+        )
+        self.action = np.zeros((self.buffer_size, number_of_joints), dtype=np.float32)
+        self.reward = np.zeros(self.buffer_size, dtype=np.float32)
+        # terminal flags are kept as floats so they can be used directly in the critic label computation
+        self.terminated = np.zeros(self.buffer_size, dtype=np.float32)
+        self.next_joints = np.zeros(
+            (self.buffer_size, number_of_joints), dtype=np.float32
+        )
+        self.next_poses = np.zeros((self.buffer_size,) + poses_shape, dtype=np.float32)
 
     def add(
         self,
@@ -19,31 +54,47 @@ class ReplayBuffer(object):
         terminated,
         next_state,
     ):
-        experience = (
-            goal_pose,
-            goal_joints,
-            workspace_id,
-            current_state,
-            action,
-            reward,
-            terminated,
-            next_state,
-        )
+        index = self._next_index
+        self.goal_pose[index] = goal_pose
+        self.goal_joints[index] = goal_joints
+        if self.image_cache is not None:
+            self.workspace_index[index] = self.image_cache.get_index(workspace_id)
+        self.current_joints[index] = current_state[0]
+        self.current_poses[index] = self._poses_to_array(current_state[1])
+        self.action[index] = action
+        # the reward model gives the reward as a single element array
+        self.reward[index] = np.asarray(reward).reshape(())
+        self.terminated[index] = terminated
+        self.next_joints[index] = next_state[0]
+        self.next_poses[index] = self._poses_to_array(next_state[1])
+
+        self._next_index = (index + 1) % self.buffer_size
         if self.count < self.buffer_size:
-            self.buffer.append(experience)
             self.count += 1
-        else:
-            self.buffer.popleft()
-            self.buffer.append(experience)
+
+    def _poses_to_array(self, poses):
+        return [poses[p] for p in self.potential_points_order]
 
     def size(self):
         return self.count
 
     def sample_batch(self, batch_size):
         count = min([batch_size, self.count])
-        batch = random.sample(self.buffer, count)
-        return zip(*batch)
-
-    # def clear(self):
-    #     self.buffer.clear()
-    #     self.count = 0
+        indices = self._random.randint(0, self.count, count)
+        # states are returned already unpacked: (joints, poses, jacobians)
+        current_state = (
+            self.current_joints[indices],
+            self.current_poses[indices],
+            None,
+        )
+        next_state = (self.next_joints[indices], self.next_poses[indices], None)
+        return (
+            self.goal_pose[indices],
+            self.goal_joints[indices],
+            self.workspace_index[indices],
+            current_state,
+            self.action[indices],
+            self.reward[indices],
+            self.terminated[indices],
+            next_state,
+        )
@@ -6,6 +6,7 @@ import bz2
 import numpy as np
 import tensorflow as tf
 import multiprocessing
+import threading
 import Queue
 import datetime
 import time
@@ -321,7 +322,50 @@ class FixedRolloutManager:
             actor_queue.put((0,))
             actor_queue.join()
 
+        # episodes generated in the background (see generate_episodes_async)
+        self._async_generation_thread = None
+        self._async_episodes = None
+        # an error raised by the background generation, raised again to the caller when waiting for it
+        self._async_error = None
+
     def generate_episodes(self, number_of_episodes, is_train):
+        # all the episodes share the same queues, wait for the background generation before starting a new one
+        self.wait_for_async_episodes()
+        return self._generate_episodes(number_of_episodes, is_train)
+
+    def generate_episodes_async(self, number_of_episodes, is_train):
+        # generates the episodes in a background thread so the caller can keep training in the meantime, the episodes
+        # are later retrieved by get_async_episodes
+        self.wait_for_async_episodes()
+
+        def generate():
+            try:
+                self._async_episodes = self._generate_episodes(
+                    number_of_episodes, is_train
+                )
+            except Exception as e:
+                self._async_error = e
+
+        self._async_generation_thread = threading.Thread(target=generate)
+        self._async_generation_thread.daemon = True
+        self._async_generation_thread.start()
+
+    def wait_for_async_episodes(self):
+        if self._async_generation_thread is not None:
+            self._async_generation_thread.join()
+            self._async_generation_thread = None
+        if self._async_error is not None:
+            error = self._async_error
+            self._async_error = None
+            raise error
+
+    def get_async_episodes(self):
+        self.wait_for_async_episodes()
+        episodes = self._async_episodes
+        self._async_episodes = None
+        return episodes
+
+    def _generate_episodes(self, number_of_episodes, is_train):
         # use collectors to generate queries
         for i in range(number_of_episodes):
             # get a query
@@ -349,6 +393,7 @@ class FixedRolloutManager:
         self._post_private_message(message, self.actor_specific_queues)
 
     def end(self):
+        self.wait_for_async_episodes()
         message = (1,)
         self._post_private_message(message, self.actor_specific_queues)
         self._post_private_message(
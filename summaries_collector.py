@@ -4,28 +4,30 @@ import tensorflow as tf
 
 class SummariesCollector:
     def __init__(self, summaries_dir, model_name):
+        # the writers write the events to disk in a background thread. the train summaries are written during the
+        # updates, so they are left to the periodic flush of the writer, the test summaries are flushed right away
         self._train_summary_writer = tf.summary.FileWriter(
             os.path.join(summaries_dir, "train_" + model_name)
         )
         self.write_train_episode_summaries = self._init_episode_summaries(
-            "train", self._train_summary_writer
+            "train", self._train_summary_writer, flush=False
         )
         self.write_train_curriculum_summaries = self._init_curriculum_summaries(
-            "train", self._train_summary_writer
+            "train", self._train_summary_writer, flush=False
         )
 
         self._test_summary_writer = tf.summary.FileWriter(
             os.path.join(summaries_dir, "test_" + model_name)
         )
         self.write_test_episode_summaries = self._init_episode_summaries(
-            "test", self._test_summary_writer
+            "test", self._test_summary_writer, flush=True
         )
         self.write_test_curriculum_summaries = self._init_curriculum_summaries(
-            "test", self._test_summary_writer
+            "test", self._test_summary_writer, flush=True
         )
 
     @staticmethod
-    def _init_episode_summaries(prefix, summary_writer):
+    def _init_episode_summaries(prefix, summary_writer, flush):
         episodes_played_var = tf.Variable(0, trainable=False, dtype=tf.float32)
         successful_episodes_var = tf.Variable(0, trainable=False, dtype=tf.float32)
         collision_episodes_var = tf.Variable(0, trainable=False, dtype=tf.float32)
@@ -68,12 +70,13 @@ class SummariesCollector:
             )
 
             summary_writer.add_summary(summary_str, global_step)
-            summary_writer.flush()
+            if flush:
+                summary_writer.flush()
 
         return write_episode_summaries
 
     @staticmethod
-    def _init_curriculum_summaries(prefix, summary_writer):
+    def _init_curriculum_summaries(prefix, summary_writer, flush):
         curriculum_status_var = tf.Variable(0, trainable=False, dtype=tf.float32)
         summaries = tf.summary.scalar(
             prefix + "_curriculum_status", curriculum_status_var
@@ -85,7 +88,8 @@ class SummariesCollector:
             summary_str = sess.run(summaries, feed_dict={curriculum_status_var: status})
 
             summary_writer.add_summary(summary_str, global_step)
-            summary_writer.flush()
+            if flush:
+                summary_writer.flush()
 
         return write_curriculum_summaries
 
@@ -93,4 +97,8 @@ class SummariesCollector:
         for s in summaries:
             if s is not None:
                 self._train_summary_writer.add_summary(s, global_step)
-        self._train_summary_writer.flush()
+
+    def close(self):
+        # writes all the pending summaries
+        self._train_summary_writer.close()
+        self._test_summary_writer.close()